@@ -1,12 +1,17 @@
 import os
+from collections.abc import AsyncIterator
 from sqlmodel import SQLModel, Field, Column, JSON, select
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import Index, Row, event, insert, tuple_
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from datetime import datetime, timedelta
 
 
 class EventSummary(SQLModel, table=True):
     __tablename__ = "event_summaries"
+    __table_args__ = (
+        Index("ix_event_created_at", "created_at"),
+    )
     
     id: int | None = Field(default=None, primary_key=True)
     payload: dict = Field(sa_column=Column(JSON))
@@ -16,21 +21,53 @@ class EventSummary(SQLModel, table=True):
 
 class Accident(SQLModel, table=True):
     __tablename__ = "accidents"
+    __table_args__ = (
+        Index("ix_accident_lookup", "accident_type", "repo_name", "timestamp"),
+    )
     
     id: int | None = Field(default=None, primary_key=True)
-    accident_type: str = Field(index=True)
-    timestamp: datetime = Field(default_factory=datetime.now, index=True)
-    repo_name: str = Field(index=True)
+    accident_type: str = Field()
+    timestamp: datetime = Field(default_factory=datetime.now)
+    repo_name: str = Field()
     
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./event_summary.db")
-engine = create_async_engine(DATABASE_URL, echo=True)
-async_session_maker = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+engine = create_async_engine(
+    DATABASE_URL,
+    echo=os.getenv("SQL_ECHO") == "1",
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=20,
+    max_overflow=30,
+    pool_pre_ping=True,
+    pool_use_lifo=True,
+    pool_recycle=1800
+)
+async_session_maker = async_sessionmaker(engine, expire_on_commit=False)
+
+
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine.sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA cache_size=-64000")
+        cursor.execute("PRAGMA mmap_size=268435456")
+        cursor.close()
+
+
+def create_missing_indexes(conn) -> None:
+    # create_all() skips indexes on tables that already exist
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
 
 
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(SQLModel.metadata.create_all)
+        await conn.run_sync(create_missing_indexes)
         
         
 async def save_accident(
@@ -38,13 +75,33 @@ async def save_accident(
     repo_name: str
 )-> Accident:
     async with async_session_maker() as session:
-        accident = Accident(accident_type=accident_type, repo_name=repo_name)
-        session.add(accident)
+        statement = insert(Accident).values(
+            accident_type=accident_type,
+            repo_name=repo_name,
+            timestamp=datetime.now()
+        ).returning(Accident)
+        
+        accident = (await session.execute(statement)).scalar_one()
         await session.commit()
-        await session.refresh(accident)
         return accident
     
 
+async def save_accidents_bulk(
+    accidents: list[tuple[str, str]]
+) -> None:
+    if not accidents:
+        return
+    
+    now = datetime.now()
+    rows = [
+        {"accident_type": accident_type, "repo_name": repo_name, "timestamp": now}
+        for accident_type, repo_name in accidents
+    ]
+    async with async_session_maker() as session:
+        async with session.begin():
+            await session.execute(insert(Accident), rows)
+    
+
 async def get_accidents(
     accident_type: str,
     repo_name: str,
@@ -71,25 +128,83 @@ async def save_event_summary(
     summary: str
 ) -> EventSummary:
     async with async_session_maker() as session:
-        event = EventSummary(payload=payload, summary=summary)
-        session.add(event)
+        statement = insert(EventSummary).values(
+            payload=payload,
+            summary=summary,
+            created_at=datetime.now()
+        ).returning(EventSummary)
+        
+        event = (await session.execute(statement)).scalar_one()
         await session.commit()
-        await session.refresh(event)
         return event
+
+
+async def save_event_summaries_bulk(
+    events: list[tuple[dict, str]]
+) -> None:
+    if not events:
+        return
     
+    now = datetime.now()
+    rows = [
+        {"payload": payload, "summary": summary, "created_at": now}
+        for payload, summary in events
+    ]
+    async with async_session_maker() as session:
+        async with session.begin():
+            await session.execute(insert(EventSummary), rows)
+    
+
+async def stream_event_summaries(
+    since: float = 0, 
+    limit: int = 50,
+    after_id: int | None = None
+) -> AsyncIterator[EventSummary]:
+    # Keyset pagination: callers page forward by passing the created_at and id
+    # of the last row they received as `since` and `after_id`, which is an
+    # index range scan. The id breaks ties between rows saved in one bulk
+    # insert, which share a created_at.
+    since_at = datetime.fromtimestamp(since)
+    if after_id is None:
+        cursor = EventSummary.created_at > since_at
+    else:
+        cursor = tuple_(EventSummary.created_at, EventSummary.id) > tuple_(since_at, after_id)
+    
+    async with async_session_maker() as session:
+        statement = select(EventSummary).where(cursor).order_by(
+            EventSummary.created_at.asc(), EventSummary.id.asc()
+        ).limit(limit)
+        
+        async for summary in await session.stream_scalars(statement):
+            yield summary
+
 
 async def get_event_summaries(
-    since: int = 0, 
-    limit: int = 50, 
-    offset: int = 0
+    since: float = 0, 
+    limit: int = 50,
+    after_id: int | None = None
 ) -> list[EventSummary]:
+    return [summary async for summary in stream_event_summaries(since, limit, after_id)]
+
+
+
+async def get_event_summary_headlines(
+    after_id: int = 0,
+    limit: int = 50
+) -> list[Row]:
     async with async_session_maker() as session:
-        statement = select(EventSummary).where(
-            EventSummary.created_at > datetime.fromtimestamp(since)
-        ).order_by(EventSummary.created_at.asc()).limit(limit).offset(offset)
+        statement = select(
+            EventSummary.id,
+            EventSummary.summary,
+            EventSummary.created_at,
+            EventSummary.payload["type"].as_string().label("event_type"),
+            EventSummary.payload[("repo", "name")].as_string().label("repo_name")
+        ).where(
+            EventSummary.id > after_id
+        ).order_by(EventSummary.id.asc()).limit(limit)
         
         result = await session.execute(statement)
-        return result.scalars().all()
+        return result.all()
     
     
 async def get_event_summaries_by_repo(
@@ -1,9 +1,28 @@
 import os
-import json
+import logging
 import math
 import time
+import random
 import asyncio
 import httpx
+import orjson
+from datetime import datetime, timezone
+from redis.asyncio import Redis
+
+
+logger = logging.getLogger(__name__)
+
+NULL_SHA = "0" * 40
+PROTECTED_REFS = frozenset(("refs/heads/main", "refs/heads/master"))
+SPAM_EVENT_TYPES = frozenset(("IssuesEvent", "PullRequestEvent"))
+SPAM_EVENT_ACTIONS = frozenset(("opened", "reopened"))
+SEEN_EVENT_TTL = 60 * 60 # 1 hour
+COMPARE_CACHE_TTL = 24 * 60 * 60 # 24 hours
+WEBHOOK_EVENT_TYPES = {
+    "push": "PushEvent",
+    "issues": "IssuesEvent",
+    "pull_request": "PullRequestEvent"
+}
 
 
 class Github:
@@ -15,63 +34,102 @@ class Github:
     and spam activity.
     
     Attributes:
+        redis_client (Redis): Redis client used for event queues and spam tracking
         base_delay (float): Base delay in seconds for exponential backoff (default: 60s)
         max_delay (float): Maximum delay in seconds between retries (default: 900s/15min)
         max_retries (int): Maximum number of retry attempts (default: 10)
-        poll_interval (int): Interval in seconds between polling requests (default: 15s)
+        poll_interval (int): Current interval in seconds between polling requests (default: 15s)
+        min_poll_interval (int): Floor for poll_interval, raised to GitHub's X-Poll-Interval
+        poll_decrease (float): Factor poll_interval is multiplied by after each successful poll
+        backoff_delays (tuple[float, ...]): Precomputed exponential backoff cap per attempt
         ETag (str | None): ETag value from previous request for conditional requests
         attempts (int): Current number of retry attempts
+        semaphore (asyncio.Semaphore): Limits concurrent compare requests to respect rate limits
+        headers (dict): GitHub API headers, built once at construction
+        client (httpx.AsyncClient): Shared HTTP/2 client reused across all GitHub requests
     """
     def __init__(
         self, 
+        redis_client: Redis,
         base_delay: float = 60.0, # 1 minute
         max_delay: float = 15 * 60.0, # 15 minutes 
         max_retries: int = 10, # 10 attempts 
-        poll_interval: int = 15 # 15 seconds
+        poll_interval: int = 15, # 15 seconds
+        poll_decrease: float = 0.75, # shrink by 25% per successful poll
+        max_concurrency: int = 8 # 8 in-flight compare requests
     ) -> None:
         """
         Initialize GitHub API client.
         
         Args:
+            redis_client: Redis client used for event queues and spam tracking
             base_delay: Base delay for exponential backoff in seconds
             max_delay: Maximum delay between retries in seconds
             max_retries: Maximum number of retry attempts before giving up
             poll_interval: Time to wait between successful polls in seconds
+            poll_decrease: Factor the poll interval is multiplied by after each successful poll
+            max_concurrency: Maximum number of concurrent compare requests
+            
+        Raises:
+            KeyError: If GITHUB_TOKEN is not set
         """
+        self.redis_client = redis_client
         self.base_delay = base_delay
         self.max_delay = max_delay
         self.max_retries = max_retries
         self.poll_interval = poll_interval
+        self.min_poll_interval = poll_interval
+        self.poll_decrease = poll_decrease
+        self.backoff_delays = tuple(
+            min(max_delay, base_delay * (2 ** attempt)) for attempt in range(max_retries + 1)
+        )
         self.ETag = None
         self.attempts = 0
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.headers = {
+            "Accept": "application/vnd.github+json",
+            "X-GitHub-Api-Version": "2022-11-28",
+            "Authorization": f"Bearer {os.environ['GITHUB_TOKEN']}"
+        }
+        self.client = httpx.AsyncClient(
+            http2=True,
+            headers=self.headers,
+            timeout=10.0,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+        )
         
     def get_headers(self) -> dict:
         """
         Get HTTP headers for GitHub API requests.
         
+        The headers are built once in __init__ and reused for every request.
+        
         Returns:
             dict: Headers including Accept, API version, and authorization token
         """
-        return {
-            "Accept": "application/vnd.github+json",
-            "X-GitHub-Api-Version": "2022-11-28",
-            "Authorization": f"Bearer {os.getenv('GITHUB_TOKEN')}"
-        }
+        return self.headers
+    
+    async def aclose(self) -> None:
+        """
+        Close the shared HTTP client and release its pooled connections.
+        """
+        await self.client.aclose()
         
     async def handle_retry_after(self, response: httpx.Response, retry_after: str) -> None:
         """
         Handle rate limiting with Retry-After header.
         
         Sleeps for the duration specified in the Retry-After header,
-        with a minimum delay of 1 second.
+        with a minimum delay of 1 second, plus up to 10% (capped at 1 second)
+        of random jitter so replicas don't all retry on the same tick.
         
         Args:
             response: HTTP response object
             retry_after: Retry-After header value in seconds
         """
-        delay = int(math.ceil(float(retry_after)))
-        print("Retry-After detected, sleeping for", delay, "seconds")
-        await asyncio.sleep(max(1, delay))
+        delay = max(1, int(math.ceil(float(retry_after))))
+        logger.warning("Retry-After detected, sleeping for %s seconds", delay)
+        await asyncio.sleep(delay + random.uniform(0, min(1.0, delay * 0.1)))
         
         self.attempts += 1
         if self.attempts > self.max_retries:
@@ -82,7 +140,8 @@ class Github:
         Handle rate limit reset by waiting until the reset time.
         
         Calculates the time until rate limit resets and sleeps until then,
-        with a minimum delay of 1 second to avoid timing issues.
+        plus up to 1 second of random jitter so replicas sharing a token
+        don't all hit the API the instant the limit resets.
         
         Args:
             response: HTTP response object
@@ -95,45 +154,83 @@ class Github:
             reset_epoch = int(ratelimit_reset)
             now = time.time()
             delay = max(0, reset_epoch - now)
-            print("Rate limit exceeded, sleeping until reset in", delay, "seconds")
-            await asyncio.sleep(delay)
+            logger.warning("Rate limit exceeded, sleeping until reset in %s seconds", delay)
+            await asyncio.sleep(delay + random.uniform(0, 1.0))
 
             self.attempts += 1
             if self.attempts > self.max_retries:
                 response.raise_for_status()
         except ValueError:
-            print("Error parsing rate limit reset time")
+            logger.error("Error parsing rate limit reset time")
             pass
         
     async def handle_exponential_backoff(self) -> None:
         """
-        Implement exponential backoff for retries.
+        Implement exponential backoff with full jitter for retries.
         
-        Calculates delay based on number of attempts using the formula:
-        delay = min(base_delay * (2 ^ attempts), max_delay)
+        Looks up the cap for the current attempt in the schedule precomputed
+        in __init__ using the formula:
+        cap = min(base_delay * (2 ^ attempts), max_delay)
         
-        Increments the attempts counter and sleeps for the calculated duration.
-        The delay doubles with each attempt up to the maximum delay.
+        Increments the attempts counter and sleeps for a random duration in
+        [0, cap], so replicas throttled at the same moment spread their
+        retries out instead of retrying in lockstep. The cap doubles with
+        each attempt up to the maximum delay.
         
-        Example delays (base_delay=60s, max_delay=900s):
+        Example caps (base_delay=60s, max_delay=900s):
             - Attempt 1: 60s
             - Attempt 2: 120s
             - Attempt 3: 240s
             - Attempt 4: 480s
             - Attempt 5+: 900s (max)
         """
-        delay = min(self.max_delay, self.base_delay * (2 ** self.attempts))
-        print("Exponential backoff, sleeping for", delay, "seconds")
+        delay = random.uniform(0, self.backoff_delays[min(self.attempts, self.max_retries)])
+        logger.warning("Exponential backoff, sleeping for %.1f seconds", delay)
         await asyncio.sleep(delay)
         self.attempts += 1
         
+    def narrow_poll_interval(self, response: httpx.Response) -> None:
+        """
+        Proportionally shrink the poll interval after a successful poll.
+        
+        Together with widen_poll_interval this adapts the polling cadence to
+        throttling: the interval doubles as soon as GitHub throttles the
+        poller and shrinks by poll_decrease per poll while it keeps
+        answering, so even max_delay recovers to the floor within about ten
+        polls. GitHub's X-Poll-Interval header raises the floor, and the
+        retry counter is reset because the rate limit has evidently recovered.
+        
+        Only called by poll_github_events, for 200 and 304 responses.
+        
+        Args:
+            response: Successful (200 or 304) HTTP response object
+        """
+        self.attempts = 0
+        self.min_poll_interval = int(response.headers.get("X-Poll-Interval", self.min_poll_interval))
+        self.poll_interval = max(self.min_poll_interval, int(self.poll_interval * self.poll_decrease))
+    
+    def widen_poll_interval(self) -> None:
+        """
+        Multiplicatively grow the poll interval after a 403/429 response.
+        
+        The interval doubles up to max_delay, so sustained throttling quickly
+        backs the poller off instead of re-triggering rate limits at the same
+        cadence once the current retry succeeds.
+        
+        Only called by poll_github_events, so throttled compare requests
+        don't slow down polling.
+        """
+        self.poll_interval = min(self.max_delay, self.poll_interval * 2)
+        logger.warning("Throttled by GitHub, poll interval widened to %s seconds", self.poll_interval)
+        
     async def handle_error_codes(self, response: httpx.Response) -> bool:
         """
         Handle GitHub API error codes and rate limiting.
         
         Implements exponential backoff for rate limiting (403, 429) and
-        server errors (500, 502, 503). Returns True if the request should
-        be retried.
+        server errors (500, 502, 503). Retry-After and X-RateLimit-Reset are
+        always honoured as a lower bound on the wait. Returns True if the
+        request should be retried.
         
         Args:
             response: HTTP response object
@@ -164,19 +261,42 @@ class Github:
             return True
 
         if response.status_code == 304:
-            self.poll_interval = int(response.headers.get("X-Poll-Interval", self.poll_interval))
             await asyncio.sleep(self.poll_interval)
             return True
         
         return False
 
 
+    def classify_push(self, payload: dict) -> bool | None:
+        """
+        Classify a push from its payload alone, without calling the GitHub API.
+        
+        Branch creations and deletions can never be force pushes. Webhook
+        payloads carry an explicit "forced" flag that settles the question.
+        
+        Args:
+            payload: PushEvent payload (event["payload"])
+            
+        Returns:
+            bool | None: True or False if the payload decides it, None if a compare call is needed
+        """
+        if payload.get("created") or payload.get("deleted"):
+            return False
+        if payload.get("before") == NULL_SHA or payload.get("head") == NULL_SHA:
+            return False
+        if payload.get("forced") is not None:
+            return bool(payload["forced"])
+        return None
+
     async def is_force_push(self, repo_name: str, before_sha: str, after_sha: str, ref: str) -> bool:
         """
         Check if a push was forced by comparing commit SHAs.
         
         Uses GitHub's compare API to determine if commits diverged,
-        indicating a force push occurred.
+        indicating a force push occurred. Results are cached in Redis under
+        cmp:{before_sha}:{after_sha} for COMPARE_CACHE_TTL, since a SHA pair
+        always compares the same way, so retries and webhook replays don't
+        spend another rate-limit unit.
         
         Args:
             repo_name: Full repository name (e.g., "owner/repo")
@@ -187,30 +307,32 @@ class Github:
         Returns:
             bool: True if push was forced, False otherwise
         """
-        if ref not in ("refs/heads/main", "refs/heads/master"):
+        if ref not in PROTECTED_REFS:
             return False
 
         try:
-            async with httpx.AsyncClient() as client:
-                compare_url = f"https://api.github.com/repos/{repo_name}/compare/{before_sha}...{after_sha}"
-                
-                headers = self.get_headers()
-                    
-                response = await client.get(
-                    compare_url,
-                    headers=headers
-                )
-                
-                if (await self.handle_error_codes(response)):
-                    return False
-                
-                if response.status_code == 200:
-                    compare_data = response.json()
-                    return compare_data.get('status') in ['diverged', 'behind']
-                
+            cache_key = f"cmp:{before_sha}:{after_sha}"
+            cached = await self.redis_client.get(cache_key)
+            if cached is not None:
+                return cached == b"1"
+            
+            compare_url = f"https://api.github.com/repos/{repo_name}/compare/{before_sha}...{after_sha}"
+            
+            async with self.semaphore:
+                response = await self.client.get(compare_url)
+            
+            if (await self.handle_error_codes(response)):
                 return False
+            
+            if response.status_code == 200:
+                compare_data = orjson.loads(response.content)
+                forced = compare_data.get('status') in ['diverged', 'behind']
+                await self.redis_client.set(cache_key, b"1" if forced else b"0", ex=COMPARE_CACHE_TTL)
+                return forced
+            
+            return False
         except Exception as e:
-            print(f"Error checking force push: {e}")
+            logger.error("Error checking force push: %s", e)
             return False
     
     async def detect_spam(self, repo_name: str, created_at: str) -> int:
@@ -218,8 +340,8 @@ class Github:
         Detect spam activity by tracking event frequency.
         
         Uses Redis sorted sets to track issue/PR creation events within
-        a 10-minute sliding window. Returns count of recent events for
-        the repository.
+        a 10-minute sliding window. All Redis commands are sent in a single
+        pipelined round trip. Returns count of recent events for the repository.
         
         Args:
             repo_name: Full repository name (e.g., "owner/repo")
@@ -228,64 +350,175 @@ class Github:
         Returns:
             int: Number of events in the last 10 minutes for this repo
         """
-        from main import redis_client
         redis_key = f"spam_check:{repo_name}"
-        timestamp = time.mktime(time.strptime(created_at, "%Y-%m-%dT%H:%M:%SZ"))
-        await redis_client.zadd(redis_key, {created_at: timestamp})
-        
+        timestamp = datetime.fromisoformat(created_at.replace("Z", "+00:00")).timestamp()
         cutoff_time = timestamp - 600
-        await redis_client.zremrangebyscore(redis_key, 0, cutoff_time)
-        await redis_client.expire(redis_key, 3600)
         
-        recent_count = await redis_client.zcard(redis_key)
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            pipe.zadd(redis_key, {created_at: timestamp})
+            pipe.zremrangebyscore(redis_key, 0, cutoff_time)
+            pipe.expire(redis_key, 3600)
+            pipe.zcard(redis_key)
+            _, _, _, recent_count = await pipe.execute()
         
         return recent_count
     
+    def event_fingerprint(self, event: dict) -> str:
+        """
+        Identify an event by its content rather than its id.
+        
+        Webhook deliveries are identified by a delivery GUID that never
+        matches the Events API id of the same event, so a repository with a
+        webhook would otherwise be processed once per source. Pushes are
+        identified by repository and head SHA, issues and pull requests by
+        repository, item number and action.
+        
+        Args:
+            event: Event in the Events API format
+            
+        Returns:
+            str: Key shared by the webhook and polled copies of an event
+        """
+        repo_name = event.get("repo", {}).get("name")
+        payload = event.get("payload", {})
+        if event["type"] == "PushEvent":
+            return f"push:{repo_name}:{payload.get('head') or payload.get('after')}"
+        
+        item = payload.get("issue") or payload.get("pull_request") or {}
+        return f"{event['type']}:{repo_name}:{item.get('number')}:{payload.get('action')}"
+    
+    async def enqueue_events(self, events: list[dict]) -> None:
+        """
+        Queue relevant GitHub events to Redis for processing.
+        
+        Filters the events, drops any event already queued within the last
+        hour (consecutive polls return overlapping pages, and webhook
+        deliveries repeat polled events; see event_fingerprint), and pushes
+        each queue's matches with a single variadic RPUSH. Deduplication and
+        enqueueing take one pipelined round trip each.
+        
+        Queues:
+            - push_events: PushEvent events to main/master (the only refs checked for force pushes)
+            - spam_events: IssuesEvent and PullRequestEvent (action=opened/reopened)
+        
+        Args:
+            events: GitHub events in the Events API format
+        """
+        candidates = [
+            ("push_events", event) for event in events
+            if event["type"] == "PushEvent"
+            and event.get("payload", {}).get("ref") in PROTECTED_REFS
+        ] + [
+            ("spam_events", event) for event in events
+            if event["type"] in SPAM_EVENT_TYPES
+            and event.get("payload", {}).get("action") in SPAM_EVENT_ACTIONS
+        ]
+        if not candidates:
+            return
+        
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            for _, event in candidates:
+                pipe.set(f"seen:{self.event_fingerprint(event)}", 1, ex=SEEN_EVENT_TTL, nx=True)
+            is_new = await pipe.execute()
+        
+        push_events = []
+        spam_events = []
+        for (queue, event), added in zip(candidates, is_new):
+            if not added:
+                continue
+            if queue == "push_events":
+                push_events.append(orjson.dumps(event))
+            else:
+                spam_events.append(orjson.dumps(event))
+        
+        if push_events or spam_events:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                if push_events:
+                    pipe.rpush("push_events", *push_events)
+                if spam_events:
+                    pipe.rpush("spam_events", *spam_events)
+                await pipe.execute()
+    
+    def webhook_to_event(self, event_name: str, delivery_id: str, body: dict) -> dict | None:
+        """
+        Convert a webhook delivery into the Events API format used by the queues.
+        
+        Args:
+            event_name: Value of the X-GitHub-Event header (e.g., "push")
+            delivery_id: Value of the X-GitHub-Delivery header
+            body: Webhook JSON payload
+            
+        Returns:
+            dict | None: Event in the Events API format, or None for unsupported webhooks
+        """
+        event_type = WEBHOOK_EVENT_TYPES.get(event_name)
+        if event_type is None:
+            return None
+        
+        repository = body.get("repository", {})
+        sender = body.get("sender", {})
+        payload = dict(body)
+        if event_type == "PushEvent":
+            payload["head"] = body.get("after")
+        
+        return {
+            "id": delivery_id,
+            "type": event_type,
+            "actor": {
+                "id": sender.get("id"),
+                "login": sender.get("login"),
+                "avatar_url": sender.get("avatar_url"),
+                "url": sender.get("url")
+            },
+            "repo": {
+                "id": repository.get("id"),
+                "name": repository.get("full_name"),
+                "url": repository.get("url")
+            },
+            "payload": payload,
+            "public": not repository.get("private", False),
+            "created_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        }
+    
     async def poll_github_events(self) -> None:
         """
         Continuously poll GitHub public events API.
         
         Fetches public GitHub events every poll_interval seconds and queues
         relevant events (PushEvent, IssuesEvent, PullRequestEvent) to Redis
-        for processing. Uses ETags for efficient polling and handles rate
-        limiting automatically.
-        
-        Queues:
-            - push_events: All PushEvent events
-            - issue_pr_events: IssuesEvent and PullRequestEvent (action=opened)
+        via enqueue_events. Uses ETags for efficient polling, follows
+        GitHub's X-Poll-Interval, and adapts the interval to throttling
+        (see narrow_poll_interval and widen_poll_interval).
             
         Runs indefinitely as a background task.
         
         Raises:
             Exception: Logs errors and continues polling after delay
         """
-        async with httpx.AsyncClient() as client:
-            while True:
-                try:
-                    headers = self.get_headers()
+        while True:
+            try:
+                headers = {"If-None-Match": self.ETag} if self.ETag else None
                 
-                    if self.ETag:
-                        headers["If-None-Match"] = self.ETag
-                    
-                    response = await client.get(
-                        "https://api.github.com/events",
-                        headers=headers
-                    )
-                    
-                    if (await self.handle_error_codes(response)):
-                        continue
+                response = await self.client.get(
+                    "https://api.github.com/events",
+                    headers=headers
+                )
+                self.ETag = response.headers.get("ETag", self.ETag)
+                
+                if response.status_code in (403, 429):
+                    self.widen_poll_interval()
+                elif response.status_code in (200, 304):
+                    self.narrow_poll_interval(response)
+                
+                if (await self.handle_error_codes(response)):
+                    continue
+                
+                if response.status_code == 200:
+                    await self.enqueue_events(orjson.loads(response.content))
+                else:
+                    logger.warning("Unexpected status %s polling GitHub events", response.status_code)
                     
-                    self.attempts = 0
-                    events = response.json()
-                    for event in events:
-                        from main import redis_client
-                        if event["type"] == "PushEvent":
-                            await redis_client.rpush("push_events", json.dumps(event))
-                        if event["type"] in ["IssuesEvent", "PullRequestEvent"]:
-                            action = event.get("payload", {}).get("action")
-                            if action in ["opened", "reopened"]:
-                                await redis_client.rpush("spam_events", json.dumps(event))
-                        
-                    await asyncio.sleep(self.poll_interval)
-                except Exception as e:
-                    print("Error polling GitHub events:", e)
+                await asyncio.sleep(self.poll_interval)
+            except Exception as e:
+                logger.error("Error polling GitHub events: %s", e)
+                await asyncio.sleep(self.poll_interval)
@@ -1,17 +1,205 @@
 import os
-from openai import OpenAI
+import time
+import uuid
+import random
+import asyncio
+import logging
+import hashlib
+import orjson
+from openai import AsyncOpenAI, DefaultAioHttpClient, RateLimitError, APIConnectionError, InternalServerError
+from redis.asyncio import Redis
 
 from database import Accident
 
-client = None
+logger = logging.getLogger(__name__)
 
-async def init_llm():
-    global client
-    client = OpenAI(
+client = None
+cache = None
+batch_buffer: list[dict] = []
+batch_flush_lock = asyncio.Lock()
+
+SUMMARY_CACHE_TTL = 24 * 60 * 60 # 24 hours
+BATCH_MAX_REQUESTS = 500
+BATCH_PAYLOADS_KEY = "summary_batch_payloads"
+BATCH_IDS_KEY = "summary_batches"
+BATCH_REQUESTS_KEY = "summary_batch:{}"
+MAX_RETRIES = 5
+MAX_RETRY_DELAY = 60.0 # 1 minute
+ESTIMATED_OUTPUT_TOKENS = 200
+MODEL_FORCE_PUSH = os.getenv("MODEL_FORCE_PUSH", "gpt-4o")
+MODEL_ACTIVITY = os.getenv("MODEL_ACTIVITY", "gpt-4o-mini")
+# Activity spikes at or above the prompt's "elevated activity" volume use the force-push model
+ACTIVITY_ESCALATION_THRESHOLD = 40
+# 24h volume label boundaries from activity_spike_instructions (elevated, spike, massive spike)
+ACTIVITY_VOLUME_THRESHOLDS = (40, 100, 200)
+
+
+class RateLimiter:
+    """
+    Token bucket limiter for OpenAI requests and tokens per minute.
+    
+    Request and token capacity refill continuously up to the per-minute
+    limits. acquire() waits until both buckets can cover a request, so
+    concurrent workers stay just under the account limits instead of
+    tripping 429s.
+    
+    Attributes:
+        max_requests (float): Requests per minute limit
+        max_tokens (float): Tokens per minute limit
+        available_requests (float): Currently available request capacity
+        available_tokens (float): Currently available token capacity
+        updated_at (float): Monotonic time of the last refill
+    """
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int) -> None:
+        """
+        Initialize the limiter with full buckets.
+        
+        Args:
+            requests_per_minute: Maximum requests per minute
+            tokens_per_minute: Maximum tokens per minute
+        """
+        self.max_requests = float(requests_per_minute)
+        self.max_tokens = float(tokens_per_minute)
+        self.available_requests = self.max_requests
+        self.available_tokens = self.max_tokens
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+        
+    def refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        self.available_requests = min(self.max_requests, self.available_requests + elapsed * self.max_requests / 60)
+        self.available_tokens = min(self.max_tokens, self.available_tokens + elapsed * self.max_tokens / 60)
+        
+    async def acquire(self, tokens: int) -> None:
+        """
+        Wait until capacity for one request of the given size is available.
+        
+        Args:
+            tokens: Estimated tokens used by the request
+        """
+        tokens = min(tokens, self.max_tokens)
+        async with self.lock:
+            while True:
+                self.refill()
+                if self.available_requests >= 1 and self.available_tokens >= tokens:
+                    self.available_requests -= 1
+                    self.available_tokens -= tokens
+                    return
+                
+                delay = max(
+                    (1 - self.available_requests) * 60 / self.max_requests,
+                    (tokens - self.available_tokens) * 60 / self.max_tokens
+                )
+                await asyncio.sleep(delay)
+                
+    def drain(self) -> None:
+        """
+        Empty both buckets after a 429 so other callers back off too.
+        """
+        self.refill()
+        self.available_requests = 0
+        self.available_tokens = 0
+
+
+limiter = RateLimiter(
+    int(os.getenv("OPENAI_RPM", "500")),
+    int(os.getenv("OPENAI_TPM", "30000"))
+)
+
+
+async def init_llm(redis_client: Redis):
+    global client, cache
+    client = AsyncOpenAI(
         api_key=os.getenv("OPENAI_API_KEY"),
+        max_retries=3,
+        timeout=30,
+        # aiohttp scales better than the default httpx transport under high concurrency
+        http_client=DefaultAioHttpClient(timeout=30)
     )
-
-
+    cache = redis_client
+
+
+def to_json(value) -> str:
+    """
+    Serialize a payload or list of models as compact JSON for the model input.
+    """
+    return orjson.dumps(value, default=lambda obj: obj.model_dump()).decode("utf-8")
+
+
+def summary_cache_key(kind: str, *fields) -> str:
+    """
+    Build the Redis key for a cached summary from the payload fields that
+    determine its content.
+    """
+    fingerprint = hashlib.sha256(orjson.dumps(fields)).hexdigest()
+    return f"summary_cache:{kind}:{fingerprint}"
+
+
+async def create_response(request: dict, on_delta=None):
+    """
+    Call the Responses API through the rate limiter, retrying transient failures.
+    
+    Rate limit and connection errors are retried with full-jitter exponential
+    backoff capped at MAX_RETRY_DELAY seconds. When on_delta is given, the
+    response is streamed and on_delta is awaited with each output text
+    delta as it arrives; a stream that fails after emitting output is not
+    retried, so listeners never see a summary twice.
+    
+    Args:
+        request: Keyword arguments for client.responses.create
+        on_delta: Optional coroutine function called with each text delta
+        
+    Returns:
+        Response: The Responses API response
+        
+    Raises:
+        openai.APIError: If the request still fails after MAX_RETRIES retries
+    """
+    tokens = (len(request["instructions"]) + len(request["input"])) // 4 + ESTIMATED_OUTPUT_TOKENS
+    for attempt in range(MAX_RETRIES + 1):
+        await limiter.acquire(tokens)
+        streamed = False
+        try:
+            # Retries are handled here so that every attempt goes through the limiter
+            responses = client.with_options(max_retries=0).responses
+            if on_delta is None:
+                return await responses.create(**request)
+            
+            async with responses.stream(**request) as stream:
+                async for event in stream:
+                    if event.type == "response.output_text.delta":
+                        streamed = True
+                        await on_delta(event.delta)
+                return await stream.get_final_response()
+        except (RateLimitError, APIConnectionError, InternalServerError) as e:
+            if attempt == MAX_RETRIES or streamed:
+                raise
+            if isinstance(e, RateLimitError):
+                limiter.drain()
+            
+            delay = random.uniform(0, min(MAX_RETRY_DELAY, 2 ** attempt))
+            logger.warning("OpenAI request failed (%s), retrying in %.1f seconds", e, delay)
+            await asyncio.sleep(delay)
+
+
+async def get_cached_summary(key: str, generate) -> str:
+    """
+    Return the summary cached under key, generating and caching it on a miss.
+    """
+    cached = await cache.get(key)
+    if cached is not None:
+        return cached.decode("utf-8")
+    
+    summary = await generate()
+    await cache.set(key, summary, ex=SUMMARY_CACHE_TTL)
+    return summary
+
+
+# The instruction strings below are static so every request shares a
+# byte-identical prefix that OpenAI's prompt cache can reuse; anything
+# event-specific must go in `input`.
 force_push_instructions = """
 You are an incident summarizer for GitHub PushEvents that involve force-pushes.
 
@@ -105,101 +293,250 @@ Now analyze event_payload and accidents, then output ONLY the raw JSON array as
 """
 
 
-async def generate_force_push_summary(payload: dict, accidents: list[Accident]) -> str:
-    response = client.responses.create(
-        model="gpt-4o",
-        instructions=force_push_instructions,
-        input="Event Payload: " + str(payload) + "\nAccidents: " + str(accidents)
+async def generate_force_push_summary(payload: dict, accidents: list[Accident], on_delta=None) -> str:
+    async def generate() -> str:
+        response = await create_response({
+            "model": MODEL_FORCE_PUSH,
+            "instructions": force_push_instructions,
+            "prompt_cache_key": "force_push",
+            "input": f"Event Payload: {to_json(payload)}\nAccidents: {to_json(accidents)}"
+        }, on_delta)
+        return response.output_text
+    
+    key = summary_cache_key(
+        "force_push",
+        payload.get("repo", {}).get("name"),
+        payload.get("actor", {}).get("login"),
+        payload.get("payload", {}).get("ref"),
+        payload.get("payload", {}).get("before"),
+        payload.get("payload", {}).get("head")
     )
-    return response.output_text
+    return await get_cached_summary(key, generate)
 
 
 activity_spike_instructions = """
-You are an incident summarizer for newly opened GitHub Issues and Pull Requests.
+Summarize a newly opened GitHub issue or pull request and the recent issue activity in its repository.
 
 INPUTS:
-- event_payload: JSON payload of either an IssuesEvent (action="opened") or PullRequestEvent (action="opened").
-- accidents: JSON ARRAY of recent GitHub event payloads (similar shape to PushEvent objects), possibly mixed types.
-  Each element may be an IssuesEvent, PullRequestEvent, or other events. Timestamps may appear as
-  created_at / timestamp / event.created_at.
+- event_payload: IssuesEvent or PullRequestEvent JSON.
+- accidents: JSON array of this repository's issue_created records from the last 24 hours (id, accident_type, timestamp, repo_name).
+
+OUTPUT: ONLY a raw JSON array of 3-5 strings, no code fences, each under 25 words:
+1. Issue or PR, number, @actor, repository.
+2. Title or purpose, truncated if long.
+3. 24h volume (number of accidents) and label: >=200 massive daily spike; 100-199 daily spike; 40-99 elevated activity; else normal daily volume. Add the peak 60-minute count if >=5.
+4. Repeated titles or a single dominant reporter, if evident.
+5. Next steps: triage, moderate, lock, rate-limit, CAPTCHA or review.
+
+EXAMPLE:
+["Issue #413 opened by @randomuser in org/api.", "Title: 'Login fails after update'.", "Daily spike: 140 issues in 24 hours; 60-minute peak 22.", "Repeated titles from one reporter.", "Enable rate limits, lock new issues and triage duplicates."]
+"""
 
-GOAL:
-Summarize the CURRENT event and assess patterns from accidents LIMITED TO: issues opened within the last 24 hours.
-(We still identify the current event type—Issue or PR—but pattern metrics are computed from Issues opened in 24h.)
-
-HOW TO PARSE:
-- Event type:
-  * If event_payload.type == "IssuesEvent" and action == "opened" → "Issue opened".
-  * If event_payload.type == "PullRequestEvent" and action == "opened" → "Pull Request opened".
-- Actor: prefer event_payload.actor.login; fallback to sender.login; else pusher.name; else "unknown".
-- Repository: prefer repository.full_name; else repo.name; else "unknown".
-- Number & title:
-  * Issue: issue.number and issue.title
-  * PR: pull_request.number and pull_request.title
-- Time fields for accidents: prefer created_at; else timestamp; else use top-level "created_at" if present.
-- For 24h window, compare accidents’ timestamps to event_payload timestamp (or "now" if missing).
-
-FILTERING FOR PATTERNS:
-- From accidents, KEEP ONLY those that are IssuesEvent with action="opened" AND within the last 24 hours for the SAME repository as event_payload (case-insensitive match on repository.full_name / repo.name).
-- Define issues_last_24h = count of those filtered accidents.
-- Also compute:
-  * unique_reporters_24h = number of distinct actor.login among filtered issues.
-  * top_title_repeats = if any exact (case-insensitive, trim) titles appear ≥3 times.
-  * hourly_bursts = max count within any rolling 60-minute window among filtered issues (estimate by grouping by hour if needed).
-  * concentration =
-      - if a single actor authored ≥50% of filtered issues → "actor-concentrated"
-      - if ≥30% of issues have highly similar titles (exact match or Jaccard ≥0.8 if available) → "title-concentrated"
-- Spike labels (choose one, based on issues_last_24h):
-  * ≥ 200 → "massive daily spike"
-  * 100–199 → "daily spike"
-  * 40–99 → "elevated activity"
-  * 0–39 → "normal daily volume"
 
-OUTPUT FORMAT (STRICT):
-- Output MUST be a raw JSON array of 3–5 strings (no code fences, no quotes around the array, no escape characters like \\n or \\").
-- The array must look exactly like: ["line 1","line 2","line 3"]
-- Each line < 25 words.
-- Include: event type, actor, repo, number; brief title/purpose; the 24h pattern label; and concrete next steps.
-
-CONTENT GUIDELINES:
-- Line 1: Identify event (Issue/PR), number, actor, repo.
-- Line 2: Brief title/purpose if available (truncate if long).
-- Line 3: Report 24h volume and spike label. Add hourly_bursts if ≥ 5.
-- Line 4: Mention concentration or repeats if detected (actor-concentrated or title-concentrated).
-- Line 5: Next steps: moderate/lock/triage/rate-limit/CAPTCHA/review.
-
-EXAMPLES (correct raw arrays):
-
-Example 1 (issues daily spike, bursts, concentration):
-["Issue #413 opened by @randomuser in backend/api.",
- "Title: 'Login fails after update'.",
- "Daily spike: 140 issues in 24 hours; burst window peak 22.",
- "Actor-concentrated and repeated titles detected.",
- "Enable rate limits, lock new issues, and triage duplicates."]
-
-Example 2 (massive daily spike, repeated titles):
-["Issue #901 opened by @bot123 in docs.",
- "Title: 'Free money!!!'.",
- "Massive daily spike: 260 issues in 24 hours.",
- "Title-concentrated spam pattern across reporters.",
- "Close and report accounts, enable CAPTCHA, restrict creation temporarily."]
-
-Example 3 (normal daily volume, no patterns):
-["PR #84 opened by @alexdev in frontend.",
- "Implements new user dashboard layout.",
- "Normal daily volume: 18 issues in 24 hours.",
- "No unusual concentration or repeats observed.",
- "Proceed with standard review and triage workflow."]
-
-Final instruction:
-Output ONLY the raw JSON array as specified above.
-"""
+def activity_spike_request(payload: dict, accidents: list[Accident]) -> dict:
+    """
+    Build the Responses API request body for an activity spike summary.
+    
+    Routine activity uses the cheaper MODEL_ACTIVITY; repositories with at
+    least ACTIVITY_ESCALATION_THRESHOLD issues in 24 hours are escalated
+    to MODEL_FORCE_PUSH.
+    """
+    escalated = len(accidents) >= ACTIVITY_ESCALATION_THRESHOLD
+    return {
+        "model": MODEL_FORCE_PUSH if escalated else MODEL_ACTIVITY,
+        "instructions": activity_spike_instructions,
+        "prompt_cache_key": "activity_spike",
+        "input": f"Event Payload: {to_json(payload)}\nAccidents: {to_json(accidents)}"
+    }
+
+
+def activity_spike_cache_key(payload: dict, accidents: list[Accident]) -> str:
+    """
+    Build the cache key for an activity spike summary.
+    
+    The summary names the issue/PR number and labels the 24h volume, so
+    both are part of the key: a hit only reuses a summary for the same item
+    (e.g. a webhook delivery and a poll of the same event) at the same
+    volume label, never another item that happens to share its title.
+    """
+    event = payload.get("payload", {})
+    item = event.get("issue") or event.get("pull_request") or {}
+    volume_label = sum(len(accidents) >= threshold for threshold in ACTIVITY_VOLUME_THRESHOLDS)
+    return summary_cache_key(
+        "activity_spike",
+        payload.get("repo", {}).get("name"),
+        payload.get("actor", {}).get("login"),
+        payload.get("type"),
+        item.get("number"),
+        (item.get("title") or "").strip().lower(),
+        volume_label
+    )
 
 
-async def generate_activity_spike_summary(payload: dict, accidents: list[Accident]) -> str:
-    response = client.responses.create(
-        model="gpt-4o",
-        instructions=activity_spike_instructions,
-        input="Event Payload: " + str(payload) + "\nAccidents: " + str(accidents)
+async def generate_activity_spike_summary(payload: dict, accidents: list[Accident], on_delta=None) -> str:
+    async def generate() -> str:
+        response = await create_response(activity_spike_request(payload, accidents), on_delta)
+        return response.output_text
+    
+    return await get_cached_summary(activity_spike_cache_key(payload, accidents), generate)
+
+
+async def enqueue_activity_spike_summary(payload: dict, accidents: list[Accident]) -> str | None:
+    """
+    Queue an activity spike summary for the OpenAI Batch API.
+    
+    Returns the cached summary immediately if one exists. Otherwise the
+    request is buffered for the next flush_batch_summaries() call and the
+    event payload is kept in Redis until its batch has been collected and
+    acknowledged with acknowledge_batch_summaries().
+    
+    Args:
+        payload: GitHub event payload being summarized
+        accidents: Recent issue creation accidents for the repository
+        
+    Returns:
+        str | None: Cached summary, or None if the request was queued
+    """
+    key = activity_spike_cache_key(payload, accidents)
+    cached = await cache.get(key)
+    if cached is not None:
+        return cached.decode("utf-8")
+    
+    custom_id = uuid.uuid4().hex
+    await cache.hset(BATCH_PAYLOADS_KEY, custom_id, orjson.dumps({"payload": payload, "cache_key": key}))
+    batch_buffer.append({
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": "/v1/responses",
+        "body": activity_spike_request(payload, accidents)
+    })
+    
+    if len(batch_buffer) >= BATCH_MAX_REQUESTS:
+        await flush_batch_summaries()
+    return None
+
+
+async def flush_batch_summaries() -> None:
+    """
+    Upload all buffered requests as a JSONL file and start a Batch API job.
+    
+    Requests are only removed from the buffer once the batch has been
+    created, so a failed upload leaves them to be retried on the next flush.
+    Flushes are serialized so concurrent callers never submit the same
+    requests twice.
+    """
+    async with batch_flush_lock:
+        if not batch_buffer:
+            return
+        
+        requests = batch_buffer[:]
+        content = b"\n".join(orjson.dumps(request) for request in requests)
+        batch_file = await client.files.create(file=("summaries.jsonl", content), purpose="batch")
+        batch = await client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/responses",
+            completion_window="24h"
+        )
+        # Requests buffered while uploading stay queued for the next flush
+        del batch_buffer[:len(requests)]
+        
+        async with cache.pipeline(transaction=False) as pipe:
+            pipe.sadd(BATCH_REQUESTS_KEY.format(batch.id), *(request["custom_id"] for request in requests))
+            pipe.sadd(BATCH_IDS_KEY, batch.id)
+            await pipe.execute()
+        logger.info("Started summary batch %s with %d requests", batch.id, len(requests))
+
+
+async def discard_batch_summaries() -> None:
+    """
+    Drop buffered requests that will never be submitted, along with the
+    pending payloads kept for them in Redis.
+    """
+    async with batch_flush_lock:
+        if not batch_buffer:
+            return
+        
+        await cache.hdel(BATCH_PAYLOADS_KEY, *(request["custom_id"] for request in batch_buffer))
+        logger.warning("Discarded %d unsubmitted batch summary requests", len(batch_buffer))
+        batch_buffer.clear()
+
+
+def response_output_text(body: dict) -> str:
+    """
+    Extract the output text from a raw Responses API response body.
+    """
+    return "".join(
+        content.get("text", "")
+        for item in body.get("output", [])
+        for content in item.get("content", []) or []
+        if content.get("type") == "output_text"
     )
-    return response.output_text
\ No newline at end of file
+
+
+async def collect_batch_summaries() -> tuple[list[tuple[dict, str]], list[str]]:
+    """
+    Collect the results of every finished summary batch.
+    
+    Successful summaries are cached like real-time ones. Batches that
+    failed, expired or were cancelled are finished too, with whatever
+    results they produced. Nothing is removed from Redis here: once the
+    summaries are saved, pass the returned batch ids to
+    acknowledge_batch_summaries(), so a failed save leaves the batches to be
+    collected again on the next call.
+    
+    Returns:
+        tuple[list[tuple[dict, str]], list[str]]: (event payload, summary)
+            pairs ready to be saved, and the ids of the finished batches
+    """
+    summaries = []
+    finished = []
+    for batch_id in await cache.smembers(BATCH_IDS_KEY):
+        batch_id = batch_id.decode("utf-8")
+        batch = await client.batches.retrieve(batch_id)
+        if batch.status in ("validating", "in_progress", "finalizing", "cancelling"):
+            continue
+        
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            
+            output = await client.files.content(file_id)
+            for line in output.content.splitlines():
+                if not line:
+                    continue
+                
+                result = orjson.loads(line)
+                response = result.get("response") or {}
+                if response.get("status_code") != 200:
+                    continue
+                
+                pending = await cache.hget(BATCH_PAYLOADS_KEY, result["custom_id"])
+                if pending is None:
+                    continue
+                
+                pending = orjson.loads(pending)
+                summary = response_output_text(response["body"])
+                await cache.set(pending["cache_key"], summary, ex=SUMMARY_CACHE_TTL)
+                summaries.append((pending["payload"], summary))
+        
+        if batch.status != "completed":
+            logger.warning("Summary batch %s ended with status %s", batch_id, batch.status)
+        finished.append(batch_id)
+    
+    return summaries, finished
+
+
+async def acknowledge_batch_summaries(batch_ids: list[str]) -> None:
+    """
+    Forget finished batches along with the pending payloads of every request
+    they were submitted with, including requests that produced no result.
+    """
+    for batch_id in batch_ids:
+        requests_key = BATCH_REQUESTS_KEY.format(batch_id)
+        custom_ids = await cache.smembers(requests_key)
+        async with cache.pipeline(transaction=False) as pipe:
+            if custom_ids:
+                pipe.hdel(BATCH_PAYLOADS_KEY, *custom_ids)
+            pipe.delete(requests_key)
+            pipe.srem(BATCH_IDS_KEY, batch_id)
+            await pipe.execute()
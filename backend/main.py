@@ -1,114 +1,458 @@
 import os
+import hmac
+import hashlib
+import logging
 import math
 import time
 import random
-from datetime import datetime, timedelta
-import json
+from datetime import datetime, timedelta, timezone
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import asyncio
 import httpx
-from redis.asyncio import Redis
+import orjson
+from redis.asyncio import BlockingConnectionPool, Redis
+from redis.asyncio.retry import Retry
+from redis.backoff import ExponentialWithJitterBackoff
 from dotenv import load_dotenv
 from pprint import pprint
+from urllib.parse import parse_qs
+
+load_dotenv()
 
 import database
 import llm
 from github import Github
 
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+logger = logging.getLogger(__name__)
+
 redis_client = None
 github_client = None
+summary_queue: asyncio.Queue = asyncio.Queue()
+stream_clients: set[asyncio.Queue] = set()
+
+PUSH_BATCH_SIZE = 32
+SPAM_BATCH_SIZE = 100
+PUSH_WORKERS = 8 # matches Github's concurrent compare requests
+SPAM_WORKERS = 12
+EVENT_QUEUE_SIZE = 256
+# Set on spam events pushed back to Redis whose accident is already recorded
+ACCIDENT_RECORDED_FIELD = "_accident_recorded"
+BATCH_FLUSH_INTERVAL = 60 # 1 minute
+USE_BATCH_SUMMARIES = os.getenv("OPENAI_BATCH_SUMMARIES", "1") == "1"
+SUMMARY_FLUSH_SIZE = 100
+SUMMARY_FLUSH_DELAY = 0.5 # 500 milliseconds
+SUMMARY_DELTAS_CHANNEL = "summary_deltas"
+SUMMARIES_CHANNEL = "summaries"
+STREAM_FALLBACK_INTERVAL = 30 # 30 seconds
+STREAM_CLIENT_QUEUE_SIZE = 1000
+REDIS_MAX_CONNECTIONS = 64
+REDIS_POOL_TIMEOUT = 10 # 10 seconds
+SUMMARY_PAGE_SIZE = 500
+SUMMARY_MAX_PAGE_SIZE = 1000
+
+def summary_delta_publisher(event_data: dict):
+    """
+    Build an on_delta callback that publishes partial summary text for an event.
+    
+    Deltas are published to the SUMMARY_DELTAS_CHANNEL Redis channel and
+    forwarded to /stream clients as "delta" events while the summary is
+    still being generated.
+    
+    Args:
+        event_data: GitHub event being summarized
+    """
+    async def publish(delta: str) -> None:
+        await redis_client.publish(SUMMARY_DELTAS_CHANNEL, orjson.dumps({
+            "event_id": event_data.get("id"),
+            "repo": event_data["repo"]["name"],
+            "type": event_data["type"],
+            "delta": delta
+        }))
+    
+    return publish
 
-async def process_push_events():
+
+async def handle_push_event(event_data: dict) -> None:
+    """
+    Check a single PushEvent for a force push and summarize it if found.
+    
+    Args:
+        event_data: Decoded GitHub PushEvent
+    """
+    has_force_push = github_client.classify_push(event_data["payload"])
+    if has_force_push is None:
+        has_force_push = await github_client.is_force_push(event_data["repo"]["name"], event_data["payload"]["before"], event_data["payload"]["head"], event_data["payload"]["ref"])
+    
+    logger.debug("%s %s", event_data["repo"]["name"], has_force_push)
+    if has_force_push:
+        logger.info("FORCE_PUSH: %s", event_data)
+        accidents = await database.get_accidents("force_push", event_data["repo"]["name"])
+        summary = await llm.generate_force_push_summary(event_data, accidents, summary_delta_publisher(event_data))
+        await summary_queue.put((event_data, summary))
+        await database.save_accident("force_push", event_data["repo"]["name"])
+        logger.info("Queued summary: %s", summary)
+
+
+async def handle_spam_event(event_data: dict) -> None:
     """
-    Process GitHub PushEvents from Redis queue to detect force pushes.
+    Check a single issue/PR event for an activity spike and summarize it if found.
     
-    Continuously polls the 'push_events' Redis queue for new push events.
-    For each event, checks if it was a force push to main/master branch.
-    If a force push is detected:
+    Args:
+        event_data: Decoded GitHub IssuesEvent or PullRequestEvent
+    """
+    spam_events = await github_client.detect_spam(event_data["repo"]["name"], event_data["created_at"])
+    
+    logger.debug("%s %s", event_data["repo"]["name"], spam_events)
+    if (spam_events >= 1):
+        logger.info("SUS ACTIVITY: %s", event_data)
+        accidents = await database.get_accidents("issue_created", event_data["repo"]["name"], hours=24)
+        if USE_BATCH_SUMMARIES:
+            summary = await llm.enqueue_activity_spike_summary(event_data, accidents)
+            if summary is None:
+                return
+        else:
+            summary = await llm.generate_activity_spike_summary(event_data, accidents, summary_delta_publisher(event_data))
+        await summary_queue.put((event_data, summary))
+        logger.info("Queued summary: %s", summary)
+
+
+async def consume_events(event_queue: asyncio.Queue, handler) -> None:
+    """
+    Run a handler over queued events one at a time.
+    
+    process_events starts PUSH_WORKERS of these consumers for push events
+    and SPAM_WORKERS for issue/PR events, so a slow GitHub or OpenAI call
+    only occupies its own consumer while the others keep draining their
+    queue, and throttled compare requests can never starve spam detection.
+    A failing event is logged and does not affect the rest.
+    
+    Args:
+        event_queue: Queue of decoded events filled by process_events
+        handler: Coroutine function processing a single decoded event
+    """
+    while True:
+        event_data = await event_queue.get()
+        try:
+            await handler(event_data)
+        except Exception as e:
+            logger.error("Error processing GitHub event: %s", e)
+        finally:
+            event_queue.task_done()
+
+
+async def requeue_events(events: dict[str, list[bytes]]) -> None:
+    """
+    Push popped but unhandled events back to the front of their Redis queues.
+    
+    Events keep their original order, so they are the next ones popped
+    when processing resumes.
+    
+    Args:
+        events: Raw events per queue name, oldest first
+    """
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for queue, batch in events.items():
+            if batch:
+                pipe.lpush(queue, *reversed(batch))
+        await pipe.execute()
+
+
+async def pop_batches(counts: dict[str, int]) -> dict[str, list[bytes]]:
+    """
+    Pop a batch of events from each Redis queue, blocking while all are empty.
+    
+    Drains every queue with non-blocking LPOPs in one pipelined round trip.
+    If all queues are empty, waits on a single BLPOP across all of them so
+    the worker wakes as soon as the next event arrives on any queue, then
+    drains whatever else has landed on that queue with LPOP count so a burst
+    is handled as one batch rather than one event per wakeup.
+    
+    Args:
+        counts: Maximum number of events to pop per queue name
+        
+    Returns:
+        dict[str, list[bytes]]: Raw events per queue, all empty if nothing
+            arrived within the timeout
+    """
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for queue, count in counts.items():
+            pipe.lpop(queue, count)
+        results = await pipe.execute()
+    
+    batches = {queue: events or [] for queue, events in zip(counts, results)}
+    if any(batches.values()):
+        return batches
+    
+    result = await redis_client.blpop(list(counts), timeout=5)
+    if result is not None:
+        queue, event = result
+        queue = queue.decode("utf-8")
+        rest = await redis_client.lpop(queue, counts[queue] - 1) if counts[queue] > 1 else None
+        batches[queue] = [event, *(rest or [])]
+    return batches
+
+
+async def process_push_batch(events: list[bytes], event_queue: asyncio.Queue) -> None:
+    """
+    Process a batch of GitHub PushEvents to detect force pushes.
+    
+    Hands the events to the push consumers through event_queue, which
+    process_events guarantees has room for the batch. For each event, checks if it was a
+    force push to the main/master branch. If a force push is detected:
     - Retrieves historical force push accidents for the repository
     - Generates an AI summary of the incident
-    - Saves the summary and records the accident in the database
+    - Queues the summary for save_queued_summaries and records the accident in the database
     
-    Runs indefinitely as a background task.
+    Args:
+        events: Raw events popped from the 'push_events' queue
+        event_queue: Queue feeding the push consume_events workers
+    """
+    for event in events:
+        event_queue.put_nowait(orjson.loads(event))
+
+
+async def process_spam_batch(events: list[bytes], event_queue: asyncio.Queue) -> None:
+    """
+    Process a batch of GitHub issue/PR events to detect spam activity.
+    
+    Records the accidents of the whole batch in a single transaction (except
+    for requeued events whose accident is already recorded), then hands the
+    events to the spam consumers through event_queue, which process_events
+    guarantees has room for the batch. For each event:
+    - Detects if there's suspicious activity (multiple events in short timeframe)
+    - If spam threshold is exceeded (≥1 suspicious events):
+      * Retrieves recent issue creation accidents from last 24 hours
+      * Generates an AI summary of the activity spike, or queues it for the
+        OpenAI Batch API when OPENAI_BATCH_SUMMARIES is enabled (default)
+      * Queues the summary for save_queued_summaries (Batch API summaries
+        are saved by process_summary_batches once their batch completes)
+    
+    Args:
+        events: Raw events popped from the 'spam_events' queue
+        event_queue: Queue feeding the spam consume_events workers
+    """
+    if not events:
+        return
+    
+    batch = [orjson.loads(event) for event in events]
+    await database.save_accidents_bulk([
+        ("issue_created", event_data["repo"]["name"]) for event_data in batch
+        if not event_data.pop(ACCIDENT_RECORDED_FIELD, False)
+    ])
+    for event_data in batch:
+        event_queue.put_nowait(event_data)
+
+
+async def process_events():
+    """
+    Consume the 'push_events' and 'spam_events' Redis queues.
+    
+    Pops up to PUSH_BATCH_SIZE push events and SPAM_BATCH_SIZE issue/PR
+    events at a time into bounded in-process queues (EVENT_QUEUE_SIZE each),
+    drained by PUSH_WORKERS and SPAM_WORKERS consume_events workers. The
+    next pop happens as soon as a batch is queued rather than when its
+    slowest event finishes. A Redis queue is only popped while its
+    in-process queue has room, so backed-up push consumers leave push
+    events waiting in Redis without holding up spam events. Blocks on one
+    BLPOP across the Redis queues while they are empty.
+    
+    Runs indefinitely as a background task. When cancelled, events that
+    were popped but not handled yet are pushed back to the front of their
+    Redis queues.
     
     Raises:
         Exception: Logs any errors and continues processing after 5s delay
     """
+    batch_sizes = {"push_events": PUSH_BATCH_SIZE, "spam_events": SPAM_BATCH_SIZE}
+    event_queues = {queue: asyncio.Queue(maxsize=EVENT_QUEUE_SIZE) for queue in batch_sizes}
+    consumers = [
+        asyncio.create_task(consume_events(event_queues["push_events"], handle_push_event))
+        for _ in range(PUSH_WORKERS)
+    ] + [
+        asyncio.create_task(consume_events(event_queues["spam_events"], handle_spam_event))
+        for _ in range(SPAM_WORKERS)
+    ]
+    unqueued = {}
+    try:
+        while True:
+            try:
+                counts = {
+                    queue: min(size, EVENT_QUEUE_SIZE - event_queues[queue].qsize())
+                    for queue, size in batch_sizes.items()
+                }
+                counts = {queue: count for queue, count in counts.items() if count > 0}
+                if not counts:
+                    # Every consumer is busy; leave events in Redis until one frees up
+                    await asyncio.sleep(1)
+                    continue
+                
+                pop = asyncio.ensure_future(pop_batches(counts))
+                try:
+                    unqueued = await asyncio.shield(pop)
+                except asyncio.CancelledError:
+                    # A cancelled BLPOP can still be served on the server, so
+                    # let it finish (at most its 5s timeout) and requeue its events
+                    unqueued = await pop
+                    raise
+                await process_push_batch(unqueued.pop("push_events", []), event_queues["push_events"])
+                await process_spam_batch(unqueued.get("spam_events", []), event_queues["spam_events"])
+                unqueued = {}
+            except Exception as e:
+                logger.error("Error processing GitHub events: %s", e)
+                unqueued = {}
+                await asyncio.sleep(5)
+    finally:
+        for consumer in consumers:
+            consumer.cancel()
+        await asyncio.gather(*consumers, return_exceptions=True)
+        
+        leftovers = {}
+        for queue, event_queue in event_queues.items():
+            leftovers[queue] = []
+            while not event_queue.empty():
+                event_data = event_queue.get_nowait()
+                if queue == "spam_events":
+                    event_data = {**event_data, ACCIDENT_RECORDED_FIELD: True}
+                leftovers[queue].append(orjson.dumps(event_data))
+            leftovers[queue].extend(unqueued.get(queue, []))
+        try:
+            await requeue_events(leftovers)
+            logger.info("Requeued %d unhandled events", sum(map(len, leftovers.values())))
+        except Exception as e:
+            logger.error("Error requeueing unhandled events: %s", e)
+
+async def relay_stream_messages():
+    """
+    Fan out summary notifications and deltas to every connected /stream client.
+    
+    Holds the process's only pub/sub connection to SUMMARY_DELTAS_CHANNEL
+    and SUMMARIES_CHANNEL and copies each message onto the queue of every
+    client in stream_clients, so open dashboards don't use up Redis
+    connections. A client too slow to keep up misses messages rather than
+    holding up the others; it still picks up saved summaries on its
+    fallback database check.
+    
+    Runs indefinitely as a background task.
+    
+    Raises:
+        Exception: Logs any errors and resubscribes after 5s delay
+    """
     while True:
         try:
-            event = await redis_client.lpop("push_events")
-            if not event:
-                await asyncio.sleep(5)
-                continue
-            
-            event_data = json.loads(event.decode('utf-8'))
-            has_force_push = await github_client.is_force_push(event_data["repo"]["name"], event_data["payload"]["before"], event_data["payload"]["head"], event_data["payload"]["ref"])
-            
-            # print(event_data["repo"]["name"], has_force_push)
-            if has_force_push:
-                print("FORCE_PUSH: ", event_data)
-                accidents = await database.get_accidents("force_push", event_data["repo"]["name"])
-                summary = await llm.generate_force_push_summary(event_data, accidents)
-                await database.save_event_summary(event_data, summary)
-                await database.save_accident("force_push", event_data["repo"]["name"])
-                print("Saved summary:", summary)
-            
-            await asyncio.sleep(0.1)
+            async with redis_client.pubsub() as pubsub:
+                await pubsub.subscribe(SUMMARY_DELTAS_CHANNEL, SUMMARIES_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    
+                    item = (message["channel"].decode("utf-8"), message["data"])
+                    for client_queue in stream_clients:
+                        try:
+                            client_queue.put_nowait(item)
+                        except asyncio.QueueFull:
+                            pass
         except Exception as e:
-            print("Error processing GitHub events:", e)
+            logger.error("Error relaying stream messages: %s", e)
             await asyncio.sleep(5)
-            
-async def process_spam_events():
+
+async def save_summaries(summaries: list[tuple[dict, str]]) -> None:
     """
-    Process GitHub issue/PR events from Redis queue to detect spam activity.
+    Save summaries in one transaction and wake up /stream clients.
     
-    Continuously polls the 'spam_events' Redis queue for new issue/PR creation events.
-    For each event:
-    - Detects if there's suspicious activity (multiple events in short timeframe)
-    - Records the accident in the database
-    - If spam threshold is exceeded (≥1 suspicious events):
-      * Retrieves recent issue creation accidents from last 24 hours
-      * Generates an AI summary of the activity spike
-      * Saves the summary to the database
+    Publishes the number of saved rows to the SUMMARIES_CHANNEL Redis
+    channel, so every /stream connection (on any worker process) queries
+    for the new rows immediately instead of on its next fallback check.
+    
+    Args:
+        summaries: (event payload, summary text) pairs to save
+    """
+    if not summaries:
+        return
+    await database.save_event_summaries_bulk(summaries)
+    await redis_client.publish(SUMMARIES_CHANNEL, len(summaries))
+
+async def save_queued_summaries():
+    """
+    Save summaries queued by the event handlers in batched transactions.
+    
+    Waits for the first queued summary, then collects up to
+    SUMMARY_FLUSH_SIZE summaries or until SUMMARY_FLUSH_DELAY seconds have
+    passed, and inserts them with a single bulk insert.
+    
+    Runs indefinitely as a background task. When cancelled, a partially
+    collected batch is put back on summary_queue for lifespan to drain, and
+    a save already in progress is allowed to finish, so no summary taken
+    off the queue is lost on shutdown.
+    
+    Raises:
+        Exception: Logs any errors and continues with the next batch
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await summary_queue.get()]
+        try:
+            deadline = loop.time() + SUMMARY_FLUSH_DELAY
+            while len(batch) < SUMMARY_FLUSH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(summary_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+        except asyncio.CancelledError:
+            for item in batch:
+                summary_queue.put_nowait(item)
+            raise
+        
+        save = asyncio.ensure_future(save_summaries(batch))
+        try:
+            await asyncio.shield(save)
+            logger.info("Saved %d summaries", len(batch))
+        except asyncio.CancelledError:
+            await asyncio.gather(save, return_exceptions=True)
+            raise
+        except Exception as e:
+            logger.error("Error saving summaries: %s", e)
+
+async def process_summary_batches():
+    """
+    Submit and collect activity spike summaries sent through the OpenAI Batch API.
+    
+    Every BATCH_FLUSH_INTERVAL seconds, uploads the requests buffered by
+    llm.enqueue_activity_spike_summary as a new batch, then saves the
+    summaries of any finished batches to the database in one transaction.
+    Finished batches are only forgotten once their summaries are saved, so
+    a failed save is retried on the next interval.
     
     Runs indefinitely as a background task.
     
     Raises:
-        Exception: Logs any errors and continues processing after 5s delay
+        Exception: Logs any errors and retries on the next interval
     """
     while True:
+        await asyncio.sleep(BATCH_FLUSH_INTERVAL)
         try:
-            event = await redis_client.lpop("spam_events")
-            if not event:
-                await asyncio.sleep(5)
-                continue
-            
-            event_data = json.loads(event.decode('utf-8'))
-            spam_events = await github_client.detect_spam(event_data["repo"]["name"], event_data["created_at"])
-            
-            print(event_data["repo"]["name"], spam_events)
-            await database.save_accident("issue_created", event_data["repo"]["name"])
-            if (spam_events >= 1):
-                print("SUS ACTIVITY: ", event_data)
-                accidents = await database.get_accidents("issue_created", event_data["repo"]["name"], hours=24)
-                summary = await llm.generate_activity_spike_summary(event_data, accidents)
-                await database.save_event_summary(event_data, summary)
-                print("Saved summary:", summary)
-            
-            await asyncio.sleep(0.1)
+            await llm.flush_batch_summaries()
+            summaries, batch_ids = await llm.collect_batch_summaries()
+            await save_summaries(summaries)
+            await llm.acknowledge_batch_summaries(batch_ids)
+            if summaries:
+                logger.info("Saved %d batch summaries", len(summaries))
         except Exception as e:
-            print("Error processing GitHub events:", e)
-            await asyncio.sleep(5)
+            logger.error("Error processing summary batches: %s", e)
 
 async def generate_synthetic_data():
     """
     Generate synthetic GitHub events for testing.
     
     Creates fake PushEvents, IssuesEvents, and PullRequestEvents with
-    realistic data structure and queues them to Redis for processing.
+    realistic data structure and queues them to Redis for processing
+    with a single RPUSH.
     """
     
     repos = [
@@ -120,8 +464,12 @@ async def generate_synthetic_data():
     
     users = ["alice", "bob", "charlie", "dave"]
     
-    # Generate spam/issue events
+    # Generate spam/issue events. The burst shares one repo and timestamp;
+    # created_at is UTC to match the "Z" suffix that detect_spam parses.
     spam_repo = random.choice(repos)
+    spam_repo_id = random.randint(100000, 999999)
+    created_at = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    spam_events = []
     for i in range(10):  # Generate burst of issues
         event = {
             "id": f"synthetic-issue-{i}",
@@ -133,7 +481,7 @@ async def generate_synthetic_data():
                 "url": "https://api.github.com/users/spammer"
             },
             "repo": {
-                "id": random.randint(100000, 999999),
+                "id": spam_repo_id,
                 "name": spam_repo,
                 "url": f"https://api.github.com/repos/{spam_repo}"
             },
@@ -148,37 +496,74 @@ async def generate_synthetic_data():
                 }
             },
             "public": True,
-            "created_at": datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
+            "created_at": created_at
         }
         
-        await redis_client.rpush("spam_events", json.dumps(event))
-        print(f"Generated issue event #{i+1} for {spam_repo}")
+        spam_events.append(orjson.dumps(event))
+        logger.info("Generated issue event #%d for %s", i + 1, spam_repo)
     
-    print("\n✅ Synthetic data generation complete!")
-    print(f"- Generated 5 force push events")
-    print(f"- Generated 10 issue events for spam detection")
+    await redis_client.rpush("spam_events", *spam_events)
+    logger.info("Synthetic data generation complete: generated 10 issue events for spam detection")
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     global redis_client, github_client
-    load_dotenv()
     
     await database.init_db()
-    await llm.init_llm()
     
-    redis_client = Redis(host=os.getenv("REDIS_HOST"), port=os.getenv("REDIS_PORT"), db=0, decode_responses=False)
-    github_client = Github()
+    # Blocking pops pin a connection while they wait; callers queue for a free
+    # connection instead of failing once the cap is reached. /stream clients
+    # share the single subscription held by relay_stream_messages.
+    redis_pool = BlockingConnectionPool(
+        host=os.getenv("REDIS_HOST"),
+        port=os.getenv("REDIS_PORT"),
+        db=0,
+        decode_responses=False,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT,
+        socket_keepalive=True,
+        health_check_interval=30,
+        retry=Retry(ExponentialWithJitterBackoff(base=0.1, cap=5), 3)
+    )
+    redis_client = Redis.from_pool(redis_pool)
+    await llm.init_llm(redis_client)
+    github_client = Github(redis_client)
     
     await generate_synthetic_data()
     
     poll_github_events_task = asyncio.create_task(github_client.poll_github_events())
-    process_push_events_task = asyncio.create_task(process_push_events())
-    process_spam_events_task = asyncio.create_task(process_spam_events())
+    process_events_task = asyncio.create_task(process_events())
+    process_summary_batches_task = asyncio.create_task(process_summary_batches())
+    save_queued_summaries_task = asyncio.create_task(save_queued_summaries())
+    relay_stream_messages_task = asyncio.create_task(relay_stream_messages())
     yield
-    poll_github_events_task.cancel()
-    process_push_events_task.cancel()
-    process_spam_events_task.cancel()
+    tasks = (
+        poll_github_events_task,
+        process_events_task,
+        process_summary_batches_task,
+        save_queued_summaries_task,
+        relay_stream_messages_task
+    )
+    for task in tasks:
+        task.cancel()
+    # Wait for the tasks to stop so summaries they were holding are back on summary_queue
+    await asyncio.gather(*tasks, return_exceptions=True)
+    try:
+        await llm.flush_batch_summaries()
+    except Exception as e:
+        logger.error("Error flushing batch summaries on shutdown: %s", e)
+        await llm.discard_batch_summaries()
+    
+    remaining = []
+    while not summary_queue.empty():
+        remaining.append(summary_queue.get_nowait())
+    try:
+        await database.save_event_summaries_bulk(remaining)
+    except Exception as e:
+        logger.error("Error saving %d summaries on shutdown: %s", len(remaining), e)
+    await github_client.aclose()
+    await redis_client.aclose()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -192,27 +577,116 @@ app.add_middleware(
 
 
 @app.get("/summary")
-async def get_summaries(since: int):
+async def get_summaries(
+    since: float,
+    after_id: int | None = None,
+    limit: int = Query(SUMMARY_PAGE_SIZE, ge=1, le=SUMMARY_MAX_PAGE_SIZE)
+):
     """
-    Get event summaries created after a specific timestamp.
+    Get a page of event summaries created after a specific timestamp.
     
-    Retrieves all event summaries that were created after the provided
-    Unix timestamp. Useful for fetching historical data or catching up
-    on missed events.
+    Retrieves up to `limit` event summaries that were created after the
+    provided Unix timestamp. Useful for fetching historical data or catching
+    up on missed events. To fetch the next page, pass back the returned
+    next_since and next_after_id; an empty items list means the client has
+    caught up.
     
     Args:
-        since: Unix timestamp (seconds since epoch). Returns all summaries
-               created after this time. Use 0 to get all summaries.
+        since: Unix timestamp (seconds since epoch). Returns summaries
+               created after this time. Use 0 to start from the beginning.
+        after_id: Id of the last summary received, from next_after_id.
+                  Together with since it resumes exactly after that row,
+                  even when several summaries share a timestamp.
+        limit: Maximum number of summaries to return (1 to SUMMARY_MAX_PAGE_SIZE)
+    
+    Rows are streamed from the database and serialised one at a time, so
+    the page is never held in memory.
+    
+    Returns:
+        StreamingResponse: JSON object with the page of summaries ordered by
+            creation time (oldest first) and the cursor for the next page:
+            {"items": [...], "next_since": 1699000000.123456, "next_after_id": 42}
+    
+    Example:
+        GET /summary?since=0  # First page
+        GET /summary?since=1699000000.123456&after_id=42  # Next page
+    """
+    async def summary_generator():
+        yield b'{"items":['
+        separator = b""
+        next_since, next_after_id = since, after_id
+        async for summary in database.stream_event_summaries(since, limit, after_id):
+            yield separator + summary.model_dump_json().encode()
+            separator = b","
+            next_since, next_after_id = summary.created_at.timestamp(), summary.id
+        yield b'],"next_since":' + orjson.dumps(next_since) + b',"next_after_id":' + orjson.dumps(next_after_id) + b"}"
+    
+    return StreamingResponse(summary_generator(), media_type="application/json")
+
+
+@app.post("/webhook")
+async def receive_webhook(request: Request):
+    """
+    Receive GitHub webhook deliveries for monitored repositories.
+    
+    Push, issues and pull_request deliveries are converted to the Events API
+    format and queued exactly like polled events, so repositories with a
+    webhook configured are processed without waiting for the next poll.
+    Deliveries must be signed with GITHUB_WEBHOOK_SECRET; the endpoint is
+    disabled when the secret is not set. Both webhook content types are
+    accepted: application/json, and application/x-www-form-urlencoded (the
+    default for webhooks created through the API), where the JSON is sent
+    in the "payload" field.
+    
+    Headers:
+        - Content-Type: application/json or application/x-www-form-urlencoded
+        - X-GitHub-Event: Webhook event name (e.g., "push")
+        - X-GitHub-Delivery: Unique delivery id
+        - X-Hub-Signature-256: HMAC-SHA256 signature of the body
     
     Returns:
-        list[EventSummary]: List of event summaries ordered by creation time (newest first)
+        dict: {"queued": bool} indicating whether the delivery was queued
+    
+    Raises:
+        HTTPException: 404 if webhooks are disabled, 401 if the signature is
+            invalid, 415 for any other content type, 400 if the payload is
+            not valid JSON
     
     Example:
-        GET /summary?since=1699000000
-        GET /summary?since=0  # Get all summaries
+        POST /webhook
     """
-    summaries = await database.get_event_summaries(since, limit=100000, offset=0)
-    return summaries
+    secret = os.getenv("GITHUB_WEBHOOK_SECRET")
+    if not secret:
+        raise HTTPException(status_code=404)
+    
+    body = await request.body()
+    expected = "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected, request.headers.get("X-Hub-Signature-256", "")):
+        raise HTTPException(status_code=401, detail="Invalid signature")
+    
+    content_type = request.headers.get("Content-Type", "").split(";")[0].strip().lower()
+    if content_type == "application/x-www-form-urlencoded":
+        payload = parse_qs(body.decode("utf-8")).get("payload", [""])[0]
+    elif content_type == "application/json":
+        payload = body
+    else:
+        raise HTTPException(status_code=415, detail="Webhook content type must be JSON or form-encoded")
+    
+    try:
+        payload = orjson.loads(payload)
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid webhook payload")
+    
+    event = github_client.webhook_to_event(
+        request.headers.get("X-GitHub-Event", ""),
+        request.headers.get("X-GitHub-Delivery", ""),
+        payload
+    )
+    if event is None:
+        return {"queued": False}
+    
+    await github_client.enqueue_events([event])
+    return {"queued": True}
 
 
 @app.get("/details")
@@ -250,10 +724,22 @@ async def stream_summaries():
     
     Establishes a persistent connection that pushes new event summaries
     to the client as they are created. On initial connection, sends all
-    historical summaries, then only new ones going forward.
+    historical summaries, then only new ones going forward. Each client
+    keeps the id of the last summary it was sent and only queries rows
+    after it. New rows are picked up as soon as save_summaries announces
+    them on the SUMMARIES_CHANNEL Redis channel, with a database check every
+    STREAM_FALLBACK_INTERVAL seconds as a safety net for missed messages.
+    
+    The stream sends data in SSE format. Only the payload fields needed to
+    render a summary card are included; the full payload is available from
+    /details:
+        data: {"id": 1, "payload": {"type": "...", "repo": {"name": "..."}}, "summary": "...", "created_at": "..."}
     
-    The stream sends data in SSE format:
-        data: {"id": 1, "payload": {...}, "summary": "...", "created_at": "..."}
+    While a summary is being generated, its partial text is sent as named
+    "delta" events, which clients can listen for with
+    addEventListener("delta", ...):
+        event: delta
+        data: {"event_id": "...", "repo": "...", "type": "...", "delta": "..."}
     
     Returns:
         StreamingResponse: SSE stream with media type "text/event-stream"
@@ -274,29 +760,41 @@ async def stream_summaries():
         };
     """
     async def event_generator():
-        last_check = 0
-        sent_ids = set()
+        last_id = 0
+        client_queue = asyncio.Queue(maxsize=STREAM_CLIENT_QUEUE_SIZE)
+        stream_clients.add(client_queue)
+        loop = asyncio.get_running_loop()
         
-        while True:
-            summaries = await database.get_event_summaries(last_check, limit=50, offset=0)
+        try:
+            while True:
+                summaries = await database.get_event_summary_headlines(last_id, limit=50)
             
-            for summary in summaries:
-                if summary.id in sent_ids:
-                    continue
+                for summary in summaries:
+                    data = orjson.dumps({
+                        "id": summary.id,
+                        "payload": {"type": summary.event_type, "repo": {"name": summary.repo_name}},
+                        "summary": summary.summary,
+                        "created_at": summary.created_at.isoformat()
+                    }).decode("utf-8")
+                    yield f"data: {data}\n\n"
+                    last_id = summary.id
                 
-                data = json.dumps({
-                    "id": summary.id,
-                    "payload": summary.payload,
-                    "summary": summary.summary,
-                    "created_at": summary.created_at.isoformat()
-                })
-                yield f"data: {data}\n\n"
-                sent_ids.add(summary.id)
+                # A full page means there is more history to catch up on
+                if len(summaries) == 50:
+                    continue
                 
-            if summaries:
-                last_check = int(max(s.created_at.timestamp() for s in summaries)) + 1
-                            
-            await asyncio.sleep(5)
+                # Forward partial summaries until new rows are saved
+                deadline = loop.time() + STREAM_FALLBACK_INTERVAL
+                while (timeout := deadline - loop.time()) > 0:
+                    try:
+                        channel, data = await asyncio.wait_for(client_queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                    if channel == SUMMARIES_CHANNEL:
+                        break
+                    yield f"event: delta\ndata: {data.decode('utf-8')}\n\n"
+        finally:
+            stream_clients.discard(client_queue)
     
     return StreamingResponse(
         event_generator(),
@@ -306,4 +804,10 @@ async def stream_summaries():
             "Connection": "keep-alive",
             "X-Accel-Buffering": "no"
         }
-    )
\ No newline at end of file
+    )
+
+
+if __name__ == "__main__":
+    import uvicorn
+    
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, loop="uvloop")